@@ -1,16 +1,18 @@
 from fastapi import APIRouter, Request, HTTPException, BackgroundTasks
-from app.services.agent_factory import agent_factory
+from app.core.container import container
 from app.core.redis import get_redis
-from app.services.tasks import process_message_buffer
-from app.services.chatwoot import chatwoot_service
-from app.services.llm_service import llm_service
+from app.core.sharding import queue_for_conversation
+from app.services.conversation_store import ConversationTurn
 import logging
-import json
 
 router = APIRouter()
 logger = logging.getLogger("fvk.webhook")
 redis_client = get_redis()
 
+# Carregados no primeiro uso: o webhook não importa o worker nem a stack de LLM
+agent_factory = container.lazy("agent_factory")
+chatwoot_service = container.lazy("chatwoot")
+
 @router.post("/chatwoot")
 async def chatwoot_webhook(request: Request, background_tasks: BackgroundTasks):
     try:
@@ -39,11 +41,9 @@ async def chatwoot_webhook(request: Request, background_tasks: BackgroundTasks):
         # COMANDO: /delme (Limpar memória)
         if content == "/delme":
             logger.info(f"🧹 Limpando memória da conversa {conversation_id}")
-            redis_client.delete(f"buffer:{conversation_id}")
-            llm_service.clear_history(conversation_id)
-
-            # Marca como bot para não disparar pausa automática quando enviar a resposta.
-            redis_client.setex(f"bot_sent:{conversation_id}", 10, "1")
+            # Limpa buffer + histórico e marca como bot (para não disparar pausa automática
+            # quando enviar a resposta) numa transação só.
+            ConversationTurn(conversation_id).clear_buffer().clear_history().mark_bot_sent(10).commit()
             background_tasks.add_task(chatwoot_service.send_text_message, account_id, conversation_id, "♻️ Memória reiniciada!")
             # Se estava pausado, aproveita e despausa (opcional, mas faz sentido)
             if "pausar_atendimento" in labels:
@@ -101,16 +101,18 @@ async def chatwoot_webhook(request: Request, background_tasks: BackgroundTasks):
         
         background_tasks.add_task(chatwoot_service.toggle_status, account_id, conversation_id, "pending")
 
-        buffer_key = f"buffer:{conversation_id}"
         msg_data = {"content": content, "role": "user", "name": sender.get("name", "User")}
-        redis_client.rpush(buffer_key, json.dumps(msg_data))
-        redis_client.expire(buffer_key, 3600) 
+        ConversationTurn(conversation_id).push_buffer(msg_data).commit()
 
         debounce_time = agent.debounce_seconds if agent.debounce_seconds > 0 else 10
         
-        task = process_message_buffer.apply_async(
+        # Enfileira pelo nome da task, sem importar app.services.tasks.
+        # Com sharding, a conversa vai sempre para a fila do seu shard (mesmo worker).
+        task = container.get("celery").send_task(
+            "process_message_buffer",
             args=[conversation_id, account_id, inbox_name],
-            countdown=debounce_time
+            countdown=debounce_time,
+            queue=queue_for_conversation(conversation_id)
         )
         
         return {"status": "buffered", "task_id": task.id}
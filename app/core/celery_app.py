@@ -25,4 +25,9 @@ celery_app.conf.update(
     task_max_retries=3,
 )
 
+# Com sharding, as tasks de um nó rodam em threads do mesmo processo para
+# compartilharem o estado local das conversas (um -P na linha de comando sobrescreve).
+if settings.SHARDING_ENABLED:
+    celery_app.conf.worker_pool = "threads"
+
 celery_app.autodiscover_tasks(["app.services.tasks"])
\ No newline at end of file
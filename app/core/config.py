@@ -47,6 +47,27 @@ class Settings(BaseSettings):
     CHATWOOT_BASE_URL: str = "https://app.chatwoot.com"
     CHATWOOT_ACCESS_TOKEN: str
 
+    # Locks de processamento por conversa
+    LOCK_TTL_SECONDS: int = 60
+    LOCK_RERUN_TTL_SECONDS: int = 3600
+
+    # Espelho assíncrono do histórico no Supabase
+    HISTORY_MIRROR_ENABLED: bool = False
+    HISTORY_MIRROR_TABLE: str = "conversation_messages"
+
+    # Cache de agentes + hot-reload ("pubsub", "poll" ou "off" = sem cache).
+    # "pubsub" só depois que o admin chamar publish_agent_change ao salvar.
+    AGENT_CONFIG_WATCH_MODE: str = "off"
+    AGENT_CONFIG_POLL_SECONDS: float = 5.0
+    AGENT_CACHE_TTL_SECONDS: int = 300
+
+    # Sharding de conversas entre workers (hash consistente + filas por shard)
+    SHARDING_ENABLED: bool = False
+    SHARD_COUNT: int = 16
+    SHARD_QUEUE_PREFIX: str = "conversations.shard"
+    WORKER_HEARTBEAT_SECONDS: int = 10
+    LOCAL_STATE_MAX_CONVERSATIONS: int = 1000   # Por processo do worker
+
     class Config:
         env_file = ".env"
         case_sensitive = True
@@ -0,0 +1,78 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger("fvk.container")
+
+
+class ServiceContainer:
+    """
+    Container de serviços com carga preguiçosa.
+    Cada serviço é registrado com um loader (que faz o import pesado) e só é
+    criado no primeiro uso. Assim o processo do webhook não carrega o que não usa.
+    """
+
+    def __init__(self):
+        self._loaders: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+        self._load_ms: Dict[str, float] = {}
+        self._lock = threading.RLock()
+
+    def register(self, name: str, loader: Callable[[], Any]):
+        self._loaders[name] = loader
+
+    def get(self, name: str) -> Any:
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+
+        with self._lock:
+            if name not in self._instances:
+                start = time.perf_counter()
+                self._instances[name] = self._loaders[name]()
+                self._load_ms[name] = (time.perf_counter() - start) * 1000
+                logger.info(f"📦 Serviço '{name}' carregado em {self._load_ms[name]:.0f}ms")
+            return self._instances[name]
+
+    def lazy(self, name: str) -> "LazyService":
+        return LazyService(self, name)
+
+    def loaded(self) -> Dict[str, float]:
+        """Serviços já carregados neste processo e quanto tempo cada um levou (ms)."""
+        return dict(self._load_ms)
+
+
+class LazyService:
+    """Proxy que resolve o serviço no container no primeiro acesso a um atributo."""
+
+    def __init__(self, container: ServiceContainer, name: str):
+        object.__setattr__(self, "_container", container)
+        object.__setattr__(self, "_name", name)
+
+    def __getattr__(self, attr):
+        return getattr(self._container.get(self._name), attr)
+
+    def __repr__(self):
+        return f"<LazyService {self._name}>"
+
+
+# --- Loaders (imports ficam aqui dentro de propósito) ---
+
+def _load_celery():
+    from app.core.celery_app import celery_app
+    return celery_app
+
+def _load_chatwoot():
+    from app.services.chatwoot import chatwoot_service
+    return chatwoot_service
+
+def _load_agent_factory():
+    from app.services.agent_factory import agent_factory
+    return agent_factory
+
+
+container = ServiceContainer()
+container.register("celery", _load_celery)
+container.register("chatwoot", _load_chatwoot)
+container.register("agent_factory", _load_agent_factory)
@@ -1,8 +1,19 @@
-from supabase import create_client, Client
+from typing import TYPE_CHECKING
 from app.core.config import settings
+import threading
 
-# Cria uma instância única (Singleton)
-supabase: Client = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+if TYPE_CHECKING:
+    from supabase import Client
 
-def get_supabase() -> Client:
-    return supabase
\ No newline at end of file
+# Instância única (Singleton), criada só no primeiro uso para não pesar o import
+_supabase = None
+_lock = threading.Lock()
+
+def get_supabase() -> "Client":
+    global _supabase
+    if _supabase is None:
+        with _lock:
+            if _supabase is None:
+                from supabase import create_client
+                _supabase = create_client(settings.SUPABASE_URL, settings.SUPABASE_KEY)
+    return _supabase
\ No newline at end of file
@@ -0,0 +1,191 @@
+import logging
+import threading
+import time
+import uuid
+from typing import Optional, Dict
+from app.core.config import settings
+from app.core.redis import get_redis
+
+logger = logging.getLogger("fvk.locks")
+
+# Pega o lock ou, se estiver ocupado, marca a flag de rerun (atômico: o dono não
+# consegue liberar entre a tentativa e a marcação)
+_ACQUIRE_SCRIPT = """
+if redis.call('set', KEYS[1], ARGV[1], 'PX', ARGV[2], 'NX') then
+    return 1
+end
+redis.call('set', KEYS[2], '1', 'EX', ARGV[3])
+return 0
+"""
+
+# Só apaga se o token ainda for nosso (evita apagar o lock de outro worker)
+# e consome a flag de rerun na mesma operação. Retorna {liberou, rerun}.
+_RELEASE_SCRIPT = """
+local released = 0
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    released = redis.call('del', KEYS[1])
+end
+local rerun = redis.call('get', KEYS[2])
+if rerun then
+    redis.call('del', KEYS[2])
+end
+return {released, rerun and 1 or 0}
+"""
+
+# Só renova se o token ainda for nosso
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+METRICS_KEY = "metrics:locks"
+
+
+class ConversationLock:
+    """
+    Lock de processamento de uma conversa.
+    O valor no Redis é um token único (uuid); só o dono consegue renovar ou liberar,
+    e as escritas do turno conferem o token antes de gravar (ver ConversationTurn.commit).
+    Enquanto estiver ativo, uma thread renova o lease a cada ttl/3.
+    """
+
+    def __init__(self, manager: "LockManager", conversation_id: int, token: str):
+        self.manager = manager
+        self.conversation_id = conversation_id
+        self.token = token
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def key(self) -> str:
+        return self.manager.lock_key(self.conversation_id)
+
+    def start_renewal(self):
+        self._thread = threading.Thread(
+            target=self._renew_loop,
+            name=f"lock-renew-{self.conversation_id}",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _renew_loop(self):
+        interval = self.manager.renew_interval
+        last_renewed = time.monotonic()
+        wait = interval
+        while not self._stop.wait(wait):
+            renewed = self.renew()
+            if renewed:
+                last_renewed = time.monotonic()
+                wait = interval
+                continue
+            if renewed is False or time.monotonic() - last_renewed >= self.manager.ttl_seconds:
+                # Script retornou 0 (token não é mais nosso) ou o TTL já venceu sem conseguir renovar
+                self.lost = True
+                self.manager._incr_metric("lost")
+                logger.warning(f"⚠️ Lock da conversa {self.conversation_id} perdido.")
+                return
+            # Erro de rede: tenta de novo logo, enquanto o lease ainda vale
+            wait = min(interval, 1.0)
+
+    def renew(self) -> Optional[bool]:
+        """True = renovado, False = o lock não é mais nosso, None = erro ao falar com o Redis."""
+        try:
+            renewed = self.manager.redis.eval(_RENEW_SCRIPT, 1, self.key, self.token, self.manager.ttl_ms)
+        except Exception as e:
+            logger.error(f"Erro ao renovar lock {self.key}: {e}")
+            return None
+        if renewed:
+            self.manager._incr_metric("renewed")
+        return bool(renewed)
+
+    def is_held(self) -> bool:
+        """Confere no Redis se o lock ainda é nosso."""
+        if self.lost:
+            return False
+        return self.manager.redis.get(self.key) == self.token
+
+    def release(self) -> bool:
+        """
+        Libera o lock (compare-and-delete).
+        Retorna True se alguém pediu para reprocessar a conversa enquanto o lock estava ativo.
+        """
+        self._stop.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1)
+
+        released, rerun = self.manager.redis.eval(
+            _RELEASE_SCRIPT, 2, self.key, self.manager.rerun_key(self.conversation_id), self.token
+        )
+        if not released:
+            self.manager._incr_metric("lost_on_release")
+            logger.warning(f"⚠️ Lock {self.key} já não era nosso ao liberar.")
+        if rerun:
+            self.manager._incr_metric("reruns")
+        return bool(rerun)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class LockManager:
+    def __init__(self, redis_client=None, ttl_seconds: int = None, rerun_ttl_seconds: int = None):
+        self.redis = redis_client or get_redis()
+        self.ttl_seconds = ttl_seconds or settings.LOCK_TTL_SECONDS
+        self.rerun_ttl_seconds = rerun_ttl_seconds or settings.LOCK_RERUN_TTL_SECONDS
+
+    @property
+    def ttl_ms(self) -> int:
+        return int(self.ttl_seconds * 1000)
+
+    @property
+    def renew_interval(self) -> float:
+        return self.ttl_seconds / 3
+
+    def lock_key(self, conversation_id: int) -> str:
+        return f"lock:processing:{conversation_id}"
+
+    def rerun_key(self, conversation_id: int) -> str:
+        return f"lock:rerun:{conversation_id}"
+
+    def acquire(self, conversation_id: int) -> Optional[ConversationLock]:
+        """
+        Tenta pegar o lock da conversa.
+        Se já estiver ocupado, marca a flag de "rodar de novo" e retorna None,
+        para o dono atual reprocessar o buffer quando terminar.
+        """
+        token = uuid.uuid4().hex
+        acquired = self.redis.eval(
+            _ACQUIRE_SCRIPT, 2, self.lock_key(conversation_id), self.rerun_key(conversation_id),
+            token, self.ttl_ms, self.rerun_ttl_seconds
+        )
+        if not acquired:
+            self._incr_metric("contended")
+            logger.info(f"🔒 Conversa {conversation_id} já em processamento. Reprocessamento agendado.")
+            return None
+
+        self._incr_metric("acquired")
+
+        lock = ConversationLock(self, conversation_id, token)
+        lock.start_renewal()
+        return lock
+
+    def _incr_metric(self, name: str):
+        try:
+            self.redis.hincrby(METRICS_KEY, name, 1)
+        except Exception as e:
+            logger.debug(f"Falha ao registrar métrica {name}: {e}")
+
+    def metrics(self) -> Dict[str, int]:
+        """Contadores de contenção (acquired, contended, renewed, lost, reruns...)."""
+        data = self.redis.hgetall(METRICS_KEY) or {}
+        return {k: int(v) for k, v in data.items()}
+
+
+lock_manager = LockManager()
@@ -0,0 +1,121 @@
+import bisect
+import hashlib
+import logging
+import threading
+import time
+from typing import Iterable, List, Optional, Set
+from app.core.config import settings
+from app.core.redis import get_redis
+
+logger = logging.getLogger("fvk.sharding")
+
+WORKERS_KEY = "shards:workers"
+
+
+def _hash(value: str) -> int:
+    # md5 e não hash(): precisa dar o mesmo valor em todos os processos
+    return int(hashlib.md5(value.encode("utf-8")).hexdigest()[:16], 16)
+
+
+def shard_for(conversation_id: int, shard_count: int = None) -> int:
+    """Conversa -> shard. Número fixo de shards, então o mapeamento nunca muda."""
+    return _hash(str(conversation_id)) % (shard_count or settings.SHARD_COUNT)
+
+
+def shard_queue(shard: int) -> str:
+    return f"{settings.SHARD_QUEUE_PREFIX}.{shard}"
+
+
+def queue_for_conversation(conversation_id: int) -> Optional[str]:
+    """Fila da conversa quando o sharding está ligado; None = fila padrão do Celery."""
+    if not settings.SHARDING_ENABLED:
+        return None
+    return shard_queue(shard_for(conversation_id))
+
+
+class HashRing:
+    """Hash consistente (com nós virtuais): shard -> worker. Entrada/saída de worker só move ~1/N dos shards."""
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = 64):
+        self.vnodes = vnodes
+        self._keys: List[int] = []
+        self._nodes: List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: str):
+        for i in range(self.vnodes):
+            key = _hash(f"{node}#{i}")
+            idx = bisect.bisect(self._keys, key)
+            self._keys.insert(idx, key)
+            self._nodes.insert(idx, node)
+
+    def node_for(self, item: str) -> Optional[str]:
+        if not self._keys:
+            return None
+        idx = bisect.bisect(self._keys, _hash(item)) % len(self._keys)
+        return self._nodes[idx]
+
+
+class ShardCoordinator:
+    """
+    Roda no processo principal de cada worker Celery.
+    Publica heartbeat, monta o anel com os workers vivos e ajusta as filas
+    de shard que este worker consome (add_consumer / cancel_consumer).
+    """
+
+    def __init__(self, celery_app, hostname: str, redis_conn=None):
+        self.celery_app = celery_app
+        self.hostname = hostname
+        self.redis = redis_conn or get_redis()
+        self.interval = settings.WORKER_HEARTBEAT_SECONDS
+        self.owned: Set[int] = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def live_workers(self) -> List[str]:
+        now = time.time()
+        # Worker sem heartbeat há 3 intervalos é considerado morto
+        self.redis.zremrangebyscore(WORKERS_KEY, 0, now - 3 * self.interval)
+        return sorted(self.redis.zrange(WORKERS_KEY, 0, -1))
+
+    def heartbeat(self):
+        self.redis.zadd(WORKERS_KEY, {self.hostname: time.time()})
+
+    def desired_shards(self, workers: List[str]) -> Set[int]:
+        ring = HashRing(workers)
+        return {s for s in range(settings.SHARD_COUNT) if ring.node_for(str(s)) == self.hostname}
+
+    def rebalance(self):
+        self.heartbeat()
+        desired = self.desired_shards(self.live_workers())
+
+        for shard in sorted(desired - self.owned):
+            self.celery_app.control.add_consumer(shard_queue(shard), destination=[self.hostname])
+        for shard in sorted(self.owned - desired):
+            self.celery_app.control.cancel_consumer(shard_queue(shard), destination=[self.hostname])
+
+        if desired != self.owned:
+            logger.info(f"🧭 {self.hostname} agora atende {len(desired)} shards: {sorted(desired)}")
+        self.owned = desired
+
+    def _loop(self):
+        while True:
+            try:
+                self.rebalance()
+            except Exception as e:
+                logger.error(f"Erro no rebalanceamento de shards: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="shard-coordinator", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Sai do anel na hora para os outros workers assumirem os shards sem esperar o timeout."""
+        self._stop.set()
+        try:
+            self.redis.zrem(WORKERS_KEY, self.hostname)
+        except Exception as e:
+            logger.error(f"Erro ao sair do anel de shards: {e}")
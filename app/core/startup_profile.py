@@ -0,0 +1,62 @@
+"""
+Relatório de tempo de import (cold start) dos processos.
+Roda `python -X importtime` num processo limpo e mostra os módulos mais caros.
+Uso:
+    python -m app.core.startup_profile main app.services.tasks --top 25
+"""
+
+import argparse
+import subprocess
+import sys
+from typing import List, Tuple
+
+
+def profile_import(module: str) -> List[Tuple[str, int, int]]:
+    """Retorna [(modulo, self_us, cumulativo_us)] do import de `module` num processo novo."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        # Mostra o erro real do import (ex: .env faltando) junto do perfil parcial
+        print(proc.stderr.splitlines()[-1] if proc.stderr else f"Falha ao importar {module}")
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = [p.strip() for p in line.split(":", 1)[1].split("|")]
+            rows.append((name, int(self_us), int(cumulative_us)))
+        except ValueError:
+            continue
+    return rows
+
+
+def report(module: str, top: int = 20):
+    rows = profile_import(module)
+    if not rows:
+        return
+
+    target = next((r for r in rows if r[0] == module), rows[-1])
+    print(f"\n⏱️ import {module}: {target[2] / 1000:.1f}ms no total")
+
+    # Só pacotes de primeiro nível (langchain, supabase, celery...) para ver quem pesa mais
+    top_level = [r for r in rows if "." not in r[0]]
+    for name, self_us, cumulative_us in sorted(top_level, key=lambda r: r[2], reverse=True)[:top]:
+        print(f"  {cumulative_us / 1000:8.1f}ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perfil de tempo de import dos processos.")
+    parser.add_argument("modules", nargs="*", default=["main", "app.services.tasks"])
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        report(module, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,7 +15,19 @@ class AgentRAGSchema(BaseModel):
     provider: str = "qdrant"
     retrieval_config: Dict[str, Any] = {"score_threshold": 0.7, "top_k": 3}
 
-# --- Parte 3: O Agente Completo ---
+# --- Parte 3: SLO de Latência (Timeout, Retry, Fallback, Hedge) ---
+class AgentLatencySchema(BaseModel):
+    timeout_seconds: float = 30.0           # Timeout de cada chamada ao modelo
+    total_budget_seconds: float = 60.0      # Prazo total do turno (retries + fallback)
+    max_retries: int = 2                    # Tentativas extras por modelo
+    backoff_base_seconds: float = 0.5       # Backoff exponencial com jitter
+    backoff_max_seconds: float = 4.0
+    fallback_model_name: Optional[str] = None  # Modelo secundário se o principal falhar
+    hedge_enabled: bool = False             # Dispara 2ª requisição se a 1ª passar do p95
+    hedge_delay_ms: Optional[int] = None    # Fixo; se vazio usa o p95 medido do modelo
+    hedge_min_delay_ms: int = 500
+
+# --- Parte 4: O Agente Completo ---
 class AgentConfig(BaseModel):
     id: UUID4
     name: str
@@ -25,6 +37,7 @@ class AgentConfig(BaseModel):
     model_name: str = "gpt-4.1-2025-04-14"
     openai_api_key: Optional[str] = None
     temperature: float = 0.7
+    latency_config: AgentLatencySchema = AgentLatencySchema()
     
     # Comportamento
     debounce_seconds: int = 10
@@ -1,23 +1,58 @@
 # app/services/agent_factory.py
 from app.core.database import get_supabase
+from app.core.config import settings
 from app.models.agent import AgentConfig, AgentToolSchema, AgentRAGSchema
+from app.services.prompt_builder import prompt_builder
+from typing import Any, Dict, Optional, Tuple
 import logging
+import threading
+import time
 
 # Configura logs para vermos o que está acontecendo
 logger = logging.getLogger("fvk.agent_factory")
 
+# Campos que vêm só da tabela 'agents' e podem ser aplicados direto no cache
+_AGENT_SCALAR_FIELDS = set(AgentConfig.model_fields) - {"id", "tools", "rag_config"}
+
 class AgentFactory:
     def __init__(self):
-        self.db = get_supabase()
+        # Cache em memória: (account_id, inbox_name) -> (AgentConfig, carregado_em)
+        # Mantido atualizado pelo config_watcher; o TTL é só uma rede de segurança.
+        self._cache: Dict[Tuple[str, str], Tuple[AgentConfig, float]] = {}
+        self._cache_lock = threading.Lock()
+        # Geração: cresce a cada mudança recebida. Um load que começou antes de uma
+        # mudança no mesmo agente não grava no cache (pode ter lido a config velha).
+        self._generation = 0
+        self._changed_at: Dict[str, int] = {}
+
+    @property
+    def db(self):
+        # Client do Supabase só é criado na primeira consulta
+        return get_supabase()
+
+    @property
+    def cache_enabled(self) -> bool:
+        return settings.AGENT_CONFIG_WATCH_MODE != "off"
+
+    def _chatwoot_key(self, agent: AgentConfig) -> Tuple[str, str]:
+        cfg = agent.chatwoot_config or {}
+        return str(cfg.get("account_id")), cfg.get("inbox_name")
 
     def get_agent_by_chatwoot(self, account_id: int, inbox_name: str) -> AgentConfig:
         """
         Busca o agente filtrando pelas configurações do Chatwoot no JSONB.
         Ex: chatwoot_config->account_id E chatwoot_config->inbox_name
         """
+        key = (str(account_id), inbox_name)
+        if self.cache_enabled:
+            cached = self._cache.get(key)
+            if cached and time.monotonic() - cached[1] < settings.AGENT_CACHE_TTL_SECONDS:
+                return cached[0]
+
+        generation = self._generation
         try:
             print(f"🔍 Buscando agente: Account {account_id} | Inbox {inbox_name}")
-            
+
             # 1. Busca o Agente na tabela 'agents'
             # Usamos a sintaxe de seta (->>) para filtrar dentro do JSONB no Postgres
             response = self.db.table("agents")\
@@ -32,54 +67,148 @@ class AgentFactory:
                 return None
 
             agent_data = response.data[0]
-            agent_id = agent_data["id"]
-            print(f"✅ Agente encontrado: {agent_data['name']} (ID: {agent_id})")
-
-            # 2. Busca Tools (JOIN manual para garantir performance e controle)
-            # Pegamos a tool configurada (agent_tools) e os detalhes dela (tools_library)
-            tools_response = self.db.table("agent_tools")\
-                .select("tool_config, tools_library(name, python_handler)")\
-                .eq("agent_id", agent_id)\
-                .eq("is_enabled", True)\
-                .execute()
-            
-            tools_list = []
-            for item in tools_response.data:
-                lib = item.get("tools_library")
-                if lib:
-                    tools_list.append(AgentToolSchema(
-                        tool_name=lib["name"],
-                        python_handler=lib["python_handler"],
-                        tool_config=item["tool_config"]
-                    ))
-
-            # 3. Busca RAG (Conhecimento)
-            rag_response = self.db.table("agent_rag")\
-                .select("*")\
-                .eq("agent_id", agent_id)\
-                .eq("is_enabled", True)\
-                .limit(1)\
-                .execute()
-            
-            rag_config = None
-            if rag_response.data:
-                r = rag_response.data[0]
-                rag_config = AgentRAGSchema(
-                    collection_name=r["collection_name"],
-                    provider=r["provider"],
-                    retrieval_config=r["retrieval_config"]
-                )
-
-            # 4. Monta e Retorna o Objeto
-            return AgentConfig(
-                **agent_data,
-                tools=tools_list,
-                rag_config=rag_config
-            )
+            print(f"✅ Agente encontrado: {agent_data['name']} (ID: {agent_data['id']})")
+
+            agent = self._build_agent(agent_data)
+            self._store(agent, key, generation)
+            return agent
 
         except Exception as e:
             logger.error(f"💥 Erro crítico na Factory: {str(e)}")
             raise e
 
+    def get_agent_by_id(self, agent_id: str) -> Optional[AgentConfig]:
+        response = self.db.table("agents")\
+            .select("*")\
+            .eq("id", str(agent_id))\
+            .eq("is_active", True)\
+            .execute()
+
+        if not response.data:
+            return None
+        return self._build_agent(response.data[0])
+
+    def _build_agent(self, agent_data: dict) -> AgentConfig:
+        agent_id = agent_data["id"]
+
+        # 2. Busca Tools (JOIN manual para garantir performance e controle)
+        # Pegamos a tool configurada (agent_tools) e os detalhes dela (tools_library)
+        tools_response = self.db.table("agent_tools")\
+            .select("tool_config, tools_library(name, python_handler)")\
+            .eq("agent_id", agent_id)\
+            .eq("is_enabled", True)\
+            .execute()
+
+        tools_list = []
+        for item in tools_response.data:
+            lib = item.get("tools_library")
+            if lib:
+                tools_list.append(AgentToolSchema(
+                    tool_name=lib["name"],
+                    python_handler=lib["python_handler"],
+                    tool_config=item["tool_config"]
+                ))
+
+        # 3. Busca RAG (Conhecimento)
+        rag_response = self.db.table("agent_rag")\
+            .select("*")\
+            .eq("agent_id", agent_id)\
+            .eq("is_enabled", True)\
+            .limit(1)\
+            .execute()
+
+        rag_config = None
+        if rag_response.data:
+            r = rag_response.data[0]
+            rag_config = AgentRAGSchema(
+                collection_name=r["collection_name"],
+                provider=r["provider"],
+                retrieval_config=r["retrieval_config"]
+            )
+
+        # 4. Monta e Retorna o Objeto
+        # latency_config vazio no banco -> usa os defaults do schema
+        if not agent_data.get("latency_config"):
+            agent_data.pop("latency_config", None)
+
+        agent = AgentConfig(
+            **agent_data,
+            tools=tools_list,
+            rag_config=rag_config
+        )
+
+        # 5. Pré-renderiza o prefixo estático do prompt (cache de prompt do provedor)
+        prompt_builder.warm(agent)
+        return agent
+
+    # -------------------------------------------------------------------------
+    # Cache + atualizações incrementais (chamadas pelo config_watcher)
+    # -------------------------------------------------------------------------
+
+    def _store(self, agent: AgentConfig, key: Tuple[str, str] = None, generation: int = None):
+        if not self.cache_enabled:
+            return
+        with self._cache_lock:
+            if generation is not None and self._changed_at.get(str(agent.id), -1) > generation:
+                logger.info(f"♻️ Agente {agent.id} mudou durante a busca. Não vai para o cache.")
+                return
+            self._cache[key or self._chatwoot_key(agent)] = (agent, time.monotonic())
+
+    def _mark_changed(self, agent_id: str) -> int:
+        """Registra a mudança mesmo se o agente não estiver em cache (pode haver um load em andamento)."""
+        with self._cache_lock:
+            self._generation += 1
+            self._changed_at[str(agent_id)] = self._generation
+            return self._generation
+
+    def _cached_keys(self, agent_id: str):
+        # Chamar com _cache_lock já adquirido
+        return [k for k, (a, _) in self._cache.items() if str(a.id) == str(agent_id)]
+
+    def evict(self, agent_id: str):
+        self._mark_changed(agent_id)
+        with self._cache_lock:
+            for key in self._cached_keys(agent_id):
+                self._cache.pop(key, None)
+        prompt_builder.invalidate(agent_id)
+
+    def apply_change(self, agent_id: str, fields: Optional[Dict[str, Any]] = None):
+        """
+        Aplica uma mudança de config vinda do feed.
+        - Só campos escalares da tabela 'agents' (prompt, debounce, modelo...): atualiza o cache direto.
+        - Tools/RAG/ativação ou delta sem campos: recarrega só esse agente do banco.
+        """
+        agent_id = str(agent_id)
+        self._mark_changed(agent_id)
+        with self._cache_lock:
+            keys = self._cached_keys(agent_id)
+        if not keys:
+            # Não está em memória neste processo: um load em andamento não vai gravar
+            # (geração mudou) e o próximo get busca no banco
+            return
+
+        if fields and set(fields) <= _AGENT_SCALAR_FIELDS and "chatwoot_config" not in fields:
+            with self._cache_lock:
+                for key in self._cached_keys(agent_id):
+                    agent, _ = self._cache[key]
+                    updated = AgentConfig.model_validate({**agent.model_dump(), **fields})
+                    self._cache[key] = (updated, time.monotonic())
+            prompt_builder.invalidate(agent_id)
+            logger.info(f"♻️ Agente {agent_id} atualizado em memória: {sorted(fields)}")
+            return
+
+        self.evict(agent_id)
+        generation = self._generation
+        agent = self.get_agent_by_id(agent_id)
+        if agent:
+            self._store(agent, generation=generation)
+            logger.info(f"♻️ Agente {agent_id} recarregado do banco.")
+        else:
+            logger.info(f"♻️ Agente {agent_id} removido/desativado. Saiu do cache.")
+
+    def clear_cache(self):
+        with self._cache_lock:
+            self._cache.clear()
+
 # Singleton (Instância Global)
-agent_factory = AgentFactory()
\ No newline at end of file
+agent_factory = AgentFactory()
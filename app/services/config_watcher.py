@@ -0,0 +1,212 @@
+# app/services/config_watcher.py
+from app.core.config import settings
+from app.core.redis import get_redis
+from app.core.database import get_supabase
+from app.core.container import container
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+import logging
+import threading
+import json
+
+logger = logging.getLogger("fvk.config_watcher")
+
+CONFIG_CHANNEL = "config:agents"
+
+# Tabelas observadas pelo poller e a coluna que aponta para o agente
+WATCHED_TABLES = {
+    "agents": "id",
+    "agent_tools": "agent_id",
+    "agent_rag": "agent_id",
+}
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc).isoformat()
+
+ChangeHandler = Callable[[str, Optional[Dict[str, Any]]], None]
+
+
+def publish_agent_change(agent_id, fields: Optional[Dict[str, Any]] = None, redis_conn=None):
+    """
+    Chamado pelas escritas do admin depois de salvar o agente.
+    `fields` é opcional: se vier só com campos da tabela 'agents', os processos
+    aplicam direto em memória; senão recarregam o agente do banco.
+    """
+    payload = json.dumps({"agent_id": str(agent_id), "fields": fields or None}, default=str)
+    (redis_conn or get_redis()).publish(CONFIG_CHANNEL, payload)
+
+
+class RedisChangeFeed:
+    """Escuta o canal de pub/sub e repassa cada delta para o handler."""
+
+    def __init__(self, on_change: ChangeHandler, redis_conn=None, channel: str = CONFIG_CHANNEL):
+        self.on_change = on_change
+        self.redis = redis_conn or get_redis()
+        self.channel = channel
+        self._pubsub = None
+        self._stop = threading.Event()
+
+    def handle_message(self, message: dict):
+        if message.get("type") != "message":
+            return
+        try:
+            data = json.loads(message["data"])
+            self.on_change(data["agent_id"], data.get("fields"))
+        except Exception as e:
+            logger.error(f"Mensagem de config inválida ({message.get('data')!r}): {e}")
+
+    def run(self):
+        self._pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(self.channel)
+        logger.info(f"📡 Escutando mudanças de config em '{self.channel}'")
+        while not self._stop.is_set():
+            try:
+                message = self._pubsub.get_message(timeout=1.0)
+                if message:
+                    self.handle_message(message)
+            except Exception as e:
+                logger.error(f"Erro no feed de config: {e}")
+                self._stop.wait(1)
+
+    def stop(self):
+        self._stop.set()
+        if self._pubsub:
+            self._pubsub.close()
+
+
+class UpdatedAtPoller:
+    """
+    Alternativa sem pub/sub: consulta as colunas updated_at das tabelas de config
+    e dispara o handler para cada agente alterado desde a última checagem.
+    Funciona com qualquer client no formato do Supabase (ex: um Postgres local via PostgREST).
+
+    O marco (since) vem do próprio banco (maior updated_at na primeira rodada), não do
+    relógio da aplicação, e a consulta usa >= para não perder linhas gravadas no mesmo
+    instante do marco; as que já foram vistas nesse instante são ignoradas.
+    Deleções não aparecem aqui (a linha some): para elas use o pub/sub
+    (publish_agent_change) ou troque o DELETE por uma coluna de soft delete que atualize o updated_at.
+    """
+
+    def __init__(self, on_change: ChangeHandler, db=None, interval_seconds: float = None):
+        self.on_change = on_change
+        self.db = db or get_supabase()
+        self.interval_seconds = interval_seconds or settings.AGENT_CONFIG_POLL_SECONDS
+        self.since: Optional[str] = None
+        # (tabela, agente) já reportados com updated_at == since
+        self._seen_at_since = set()
+        self._stop = threading.Event()
+
+    def _latest_updated_at(self) -> Optional[str]:
+        latest = None
+        for table in WATCHED_TABLES:
+            response = self.db.table(table)\
+                .select("updated_at")\
+                .order("updated_at", desc=True)\
+                .limit(1)\
+                .execute()
+            for row in response.data or []:
+                if row.get("updated_at") and (latest is None or row["updated_at"] > latest):
+                    latest = row["updated_at"]
+        return latest
+
+    def _scan(self):
+        """Agentes com updated_at >= since, sem repetir os já vistos no instante do marco."""
+        changed = set()
+        newest = self.since
+        seen = set(self._seen_at_since)
+        for table, agent_column in WATCHED_TABLES.items():
+            response = self.db.table(table)\
+                .select(f"{agent_column}, updated_at")\
+                .gte("updated_at", self.since)\
+                .execute()
+            for row in response.data or []:
+                agent_id = str(row[agent_column])
+                updated_at = row.get("updated_at")
+                if updated_at == self.since and (table, agent_id) in self._seen_at_since:
+                    continue
+                changed.add(agent_id)
+                if not updated_at:
+                    continue
+                if updated_at > newest:
+                    newest = updated_at
+                    seen = set()
+                if updated_at == newest:
+                    seen.add((table, agent_id))
+        return changed, newest, seen
+
+    def poll_once(self) -> int:
+        """Faz uma rodada de consulta. Retorna quantos agentes mudaram."""
+        if self.since is None:
+            # Primeira rodada: só marca onde o banco está (o cache começa vazio)
+            self.since = self._latest_updated_at() or _EPOCH
+            _, self.since, self._seen_at_since = self._scan()
+            return 0
+
+        changed, self.since, self._seen_at_since = self._scan()
+        for agent_id in changed:
+            self.on_change(agent_id, None)
+        return len(changed)
+
+    def run(self):
+        logger.info(f"⏲️ Poller de config a cada {self.interval_seconds}s")
+        try:
+            # Marca o ponto de partida já na subida, antes do cache começar a encher
+            self.poll_once()
+        except Exception as e:
+            logger.error(f"Erro no poller de config: {e}")
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                self.poll_once()
+            except Exception as e:
+                logger.error(f"Erro no poller de config: {e}")
+
+    def stop(self):
+        self._stop.set()
+
+
+class ConfigWatcher:
+    """Sobe o feed escolhido em AGENT_CONFIG_WATCH_MODE numa thread e aplica os deltas no agent_factory."""
+
+    def __init__(self, factory=None):
+        self._factory = factory
+        self.source = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def factory(self):
+        # Resolvido no primeiro uso: importar o config_watcher (main.py) não carrega o agent_factory
+        return self._factory or container.get("agent_factory")
+
+    def apply(self, agent_id: str, fields: Optional[Dict[str, Any]] = None):
+        try:
+            self.factory.apply_change(agent_id, fields)
+        except Exception as e:
+            # Na dúvida, tira do cache para não servir config velha
+            logger.error(f"Erro ao aplicar mudança do agente {agent_id}: {e}")
+            self.factory.evict(agent_id)
+
+    def start(self, mode: str = None, source=None):
+        """
+        Sobe o feed numa thread. `source` permite injetar um feed já montado
+        (ex: RedisChangeFeed(watcher.apply, redis_conn=fake) ou UpdatedAtPoller com Postgres local).
+        """
+        mode = mode or settings.AGENT_CONFIG_WATCH_MODE
+        if self._thread and self._thread.is_alive():
+            return
+        if source is not None:
+            self.source = source
+        elif mode == "pubsub":
+            self.source = RedisChangeFeed(self.apply)
+        elif mode == "poll":
+            self.source = UpdatedAtPoller(self.apply)
+        else:
+            logger.info("Config watcher desligado (cache de agentes desativado).")
+            return
+
+        self._thread = threading.Thread(target=self.source.run, name="config-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self.source:
+            self.source.stop()
+
+config_watcher = ConfigWatcher()
@@ -0,0 +1,243 @@
+# app/services/conversation_store.py
+from app.core.redis import get_redis
+from app.core.config import settings
+from app.core.container import container
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, List, Optional
+import redis
+import logging
+import threading
+import uuid
+import json
+
+logger = logging.getLogger("fvk.conversation_store")
+redis_client = get_redis()
+
+HISTORY_MAX_MESSAGES = 20   # Máximo de mensagens no histórico (para não estourar token)
+HISTORY_TTL_SECONDS = 86400 # Expira em 24h
+BUFFER_TTL_SECONDS = 3600
+BOT_SENT_TTL_SECONDS = 10   # Tempo para o webhook receber o eco ('message_created') de cada envio
+
+
+class ConversationTurn:
+    """
+    Unit-of-work de um turno da conversa (write-behind).
+    Junta histórico, marcador bot_sent e limpezas de buffer/histórico
+    e grava tudo numa única transação do Redis (MULTI/EXEC) no commit().
+    """
+
+    def __init__(self, conversation_id: int, redis_conn=None):
+        self.conversation_id = conversation_id
+        self.redis = redis_conn or redis_client
+        self._ops: List[Callable] = []
+        self._history: List[dict] = []
+        self._history_cleared = False
+
+    @property
+    def history_key(self) -> str:
+        return f"history:{self.conversation_id}"
+
+    @property
+    def buffer_key(self) -> str:
+        return f"buffer:{self.conversation_id}"
+
+    def add_message(self, role: str, content: str) -> "ConversationTurn":
+        self._history.append({
+            "role": role,
+            "content": content,
+            "created_at": datetime.now(timezone.utc).isoformat()
+        })
+        return self
+
+    def mark_bot_sent(self, ttl_seconds: int = BOT_SENT_TTL_SECONDS) -> "ConversationTurn":
+        """Marca que o bot vai enviar (para o webhook não pausar com o eco)."""
+        key = f"bot_sent:{self.conversation_id}"
+        self._ops.append(lambda p: p.setex(key, max(int(ttl_seconds), 1), "1"))
+        return self
+
+    def push_buffer(self, msg_data: dict) -> "ConversationTurn":
+        data = json.dumps(msg_data)
+        self._ops.append(lambda p: p.rpush(self.buffer_key, data))
+        self._ops.append(lambda p: p.expire(self.buffer_key, BUFFER_TTL_SECONDS))
+        return self
+
+    def clear_buffer(self) -> "ConversationTurn":
+        self._ops.append(lambda p: p.delete(self.buffer_key))
+        return self
+
+    def clear_history(self) -> "ConversationTurn":
+        self._ops.append(lambda p: p.delete(self.history_key))
+        self._history_cleared = True
+        return self
+
+    def _queue_history(self, pipe):
+        if not self._history:
+            return
+        pipe.rpush(self.history_key, *[
+            json.dumps({"role": m["role"], "content": m["content"]}) for m in self._history
+        ])
+        # Mantém apenas as últimas N mensagens
+        pipe.ltrim(self.history_key, -HISTORY_MAX_MESSAGES, -1)
+        pipe.expire(self.history_key, HISTORY_TTL_SECONDS)
+
+    def commit(self, lock=None) -> bool:
+        """
+        Grava o turno numa transação só.
+        Se receber o lock da conversa, só grava se o token ainda for nosso (fencing);
+        caso contrário descarta e retorna False.
+        """
+        if not self._ops and not self._history:
+            return True
+
+        with self.redis.pipeline() as pipe:
+            try:
+                if lock is not None:
+                    pipe.watch(lock.key)
+                    if pipe.get(lock.key) != lock.token:
+                        logger.warning(f"⚠️ Turno da conversa {self.conversation_id} descartado: lock não é mais nosso.")
+                        return False
+                    pipe.multi()
+                for op in self._ops:
+                    op(pipe)
+                self._queue_history(pipe)
+                history_changed = bool(self._history) or self._history_cleared
+                if history_changed:
+                    # Versão do histórico (token único, nunca se repete mesmo depois de expirar):
+                    # invalida o estado local dos workers. SET ... GET devolve a versão anterior.
+                    new_version = uuid.uuid4().hex
+                    pipe.set(history_version_key(self.conversation_id), new_version,
+                             ex=HISTORY_TTL_SECONDS, get=True)
+                results = pipe.execute()
+            except redis.WatchError:
+                logger.warning(f"⚠️ Lock da conversa {self.conversation_id} mudou durante o commit. Turno descartado.")
+                return False
+
+        if history_changed:
+            local_state.on_commit(self.conversation_id, results[-1], new_version, self._history_cleared, self._history)
+
+        if self._history and settings.HISTORY_MIRROR_ENABLED:
+            self._mirror_async()
+
+        self._ops = []
+        self._history = []
+        self._history_cleared = False
+        return True
+
+    def _mirror_async(self):
+        """Espelha o histórico no Supabase via Celery, sem bloquear a resposta."""
+        try:
+            container.get("celery").send_task(
+                "mirror_conversation_history",
+                args=[self.conversation_id, self._history]
+            )
+        except Exception as e:
+            logger.error(f"Falha ao agendar espelho do histórico ({self.conversation_id}): {e}")
+
+
+def history_version_key(conversation_id: int) -> str:
+    return f"history_ver:{conversation_id}"
+
+
+def load_history(conversation_id: int) -> List[dict]:
+    return [json.loads(item) for item in redis_client.lrange(f"history:{conversation_id}", 0, -1)]
+
+
+class LocalConversationState:
+    """
+    Histórico decodificado por conversa, na memória do processo.
+    Com o sharding ligado cada conversa cai sempre no mesmo nó, então o estado
+    local costuma estar quente: basta um GET da versão em vez do LRANGE + decode.
+    Qualquer escrita (inclusive /delme no webhook) troca a versão e invalida a cópia.
+
+    O cache é por processo: com sharding o worker usa o pool de threads (ver celery_app),
+    para que todas as tasks do nó dividam a mesma cópia. Se rodar com -P prefork,
+    cada filho tem a sua e o acerto cai para ~1/concurrency.
+    LOCAL_STATE_MAX_CONVERSATIONS é por processo.
+    """
+
+    def __init__(self, max_conversations: int = None):
+        self.max_conversations = max_conversations or settings.LOCAL_STATE_MAX_CONVERSATIONS
+        self._items: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return settings.SHARDING_ENABLED
+
+    def get_history(self, conversation_id: int) -> List[dict]:
+        if not self.enabled:
+            return load_history(conversation_id)
+
+        version = redis_client.get(history_version_key(conversation_id))
+        if version is None:
+            # Sem versão (histórico expirado ou gravado antes do versionamento): não cacheia
+            self.forget(conversation_id)
+            return load_history(conversation_id)
+
+        with self._lock:
+            entry = self._items.get(conversation_id)
+            if entry and entry[0] == version:
+                self._items.move_to_end(conversation_id)
+                return list(entry[1])
+
+        history = load_history(conversation_id)
+        self._put(conversation_id, version, history)
+        return list(history)
+
+    def on_commit(self, conversation_id: int, previous_version: Optional[str], version: str,
+                  cleared: bool, appended: List[dict]):
+        """Aplica o próprio commit na cópia local, se ela estava na versão anterior."""
+        with self._lock:
+            entry = self._items.get(conversation_id)
+            if entry is None:
+                return
+            if previous_version is None or entry[0] != previous_version:
+                # Alguém escreveu no meio: descarta e relê no próximo turno
+                self._items.pop(conversation_id, None)
+                return
+            base = [] if cleared else entry[1]
+            appended = [{"role": m["role"], "content": m["content"]} for m in appended]
+            self._items[conversation_id] = (version, (base + appended)[-HISTORY_MAX_MESSAGES:])
+
+    def _put(self, conversation_id: int, version: str, history: List[dict]):
+        with self._lock:
+            self._items[conversation_id] = (version, history)
+            self._items.move_to_end(conversation_id)
+            while len(self._items) > self.max_conversations:
+                self._items.popitem(last=False)
+
+    def forget(self, conversation_id: Optional[int] = None):
+        with self._lock:
+            if conversation_id is None:
+                self._items.clear()
+            else:
+                self._items.pop(conversation_id, None)
+
+
+local_state = LocalConversationState()
+
+
+def drain_buffer(conversation_id: int) -> list:
+    """Lê e apaga o buffer numa transação (não perde mensagem que chega entre as duas operações)."""
+    pipe = redis_client.pipeline()
+    pipe.lrange(f"buffer:{conversation_id}", 0, -1)
+    pipe.delete(f"buffer:{conversation_id}")
+    messages, _ = pipe.execute()
+    return messages
+
+
+def mark_bot_sent(conversation_id: int, ttl_seconds: int = BOT_SENT_TTL_SECONDS):
+    """Renova o bot_sent logo antes de cada envio: vale até 10s depois da última parte."""
+    redis_client.setex(f"bot_sent:{conversation_id}", ttl_seconds, "1")
+
+
+def restore_buffer(conversation_id: int, messages: list):
+    """Devolve mensagens já drenadas para o início do buffer, na ordem original."""
+    if not messages:
+        return
+    key = f"buffer:{conversation_id}"
+    pipe = redis_client.pipeline()
+    pipe.lpush(key, *reversed(messages))
+    pipe.expire(key, BUFFER_TTL_SECONDS)
+    pipe.execute()
@@ -0,0 +1,98 @@
+# app/services/latency.py
+from app.core.redis import get_redis
+from typing import Dict, List, Optional, Tuple
+import logging
+import threading
+import time
+
+logger = logging.getLogger("fvk.latency")
+
+SAMPLES_KEY = "metrics:llm:latency:{model}"
+ERRORS_KEY = "metrics:llm:errors"
+MODELS_KEY = "metrics:llm:models"
+
+class ModelLatencyTracker:
+    """
+    Janela das últimas latências (ms) por modelo, guardada no Redis
+    (como metrics:locks) para ser compartilhada entre workers e lida pela API.
+    Cada amostra é uma requisição lógica de ponta a ponta (com hedge incluso);
+    timeouts entram como amostra com o tempo gasto até o timeout.
+    Alimenta o atraso do hedge (p95) do LLMService.
+    """
+
+    def __init__(self, redis_conn=None, window: int = 200, min_samples: int = 20, refresh_seconds: float = 5.0):
+        self._redis = redis_conn
+        self.window = window
+        self.min_samples = min_samples
+        self.refresh_seconds = refresh_seconds
+        # Cópia local das amostras para não ir ao Redis em toda chamada do hedge
+        self._local: Dict[str, Tuple[float, List[float]]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def redis(self):
+        return self._redis or get_redis()
+
+    def record(self, model_name: str, latency_ms: float):
+        try:
+            key = SAMPLES_KEY.format(model=model_name)
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.sadd(MODELS_KEY, model_name)
+            pipe.lpush(key, round(latency_ms, 1))
+            pipe.ltrim(key, 0, self.window - 1)
+            pipe.execute()
+        except Exception as e:
+            logger.debug(f"Falha ao registrar latência de {model_name}: {e}")
+
+    def record_error(self, model_name: str):
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.sadd(MODELS_KEY, model_name)
+            pipe.hincrby(ERRORS_KEY, model_name, 1)
+            pipe.execute()
+        except Exception as e:
+            logger.debug(f"Falha ao registrar erro de {model_name}: {e}")
+
+    def _samples(self, model_name: str, fresh: bool = False) -> List[float]:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._local.get(model_name)
+        if cached and not fresh and now - cached[0] < self.refresh_seconds:
+            return cached[1]
+
+        samples = sorted(float(v) for v in self.redis.lrange(SAMPLES_KEY.format(model=model_name), 0, -1))
+        with self._lock:
+            self._local[model_name] = (now, samples)
+        return samples
+
+    def percentile(self, model_name: str, pct: float, fresh: bool = False) -> Optional[float]:
+        """Retorna o percentil pedido, ou None se ainda não houver amostras suficientes."""
+        samples = self._samples(model_name, fresh)
+        if len(samples) < self.min_samples:
+            return None
+        idx = min(int(round(pct / 100 * (len(samples) - 1))), len(samples) - 1)
+        return samples[idx]
+
+    def p95(self, model_name: str) -> Optional[float]:
+        try:
+            return self.percentile(model_name, 95)
+        except Exception as e:
+            logger.debug(f"Falha ao ler p95 de {model_name}: {e}")
+            return None
+
+    def snapshot(self) -> Dict[str, dict]:
+        errors = self.redis.hgetall(ERRORS_KEY) or {}
+        models = sorted(set(self.redis.smembers(MODELS_KEY) or ()) | set(errors))
+        result = {}
+        for model in models:
+            samples = self._samples(model, fresh=True)
+            result[model] = {
+                "samples": len(samples),
+                "errors": int(errors.get(model, 0)),
+                "p50_ms": self.percentile(model, 50),
+                "p95_ms": self.percentile(model, 95),
+                "p99_ms": self.percentile(model, 99),
+            }
+        return result
+
+latency_tracker = ModelLatencyTracker()
@@ -1,77 +1,202 @@
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+# LangChain é importado dentro dos métodos: só carrega no processo que gera resposta
 from app.core.config import settings
 from app.models.agent import AgentConfig
-from app.core.redis import get_redis
+from app.services.prompt_builder import prompt_builder
+from app.services.latency import latency_tracker
+from app.services.conversation_store import ConversationTurn, local_state
+from typing import Optional
+import asyncio
 import logging
-import json
+import random
+import time
 
 logger = logging.getLogger("fvk.llm")
-redis_client = get_redis()
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Só vale repetir (ou ir para o fallback) em falha passageira:
+    timeout, erro de conexão, 429 (rate limit) e 5xx.
+    Chave ausente, auth (401/403) e 400 falham na hora.
+    """
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    try:
+        from openai import APIConnectionError  # APITimeoutError herda dela
+        if isinstance(error, APIConnectionError):
+            return True
+    except ImportError:
+        pass
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
 
 class LLMService:
-    def get_llm(self, agent: AgentConfig):
+    def get_llm(self, agent: AgentConfig, model_name: Optional[str] = None):
+        from langchain_openai import ChatOpenAI
+
         api_key = agent.openai_api_key or settings.OPENAI_API_KEY
         if not api_key:
             raise ValueError("API Key não configurada")
             
-        model_name = agent.model_name
+        model_name = model_name or agent.model_name
         if model_name == "gpt-4.1": model_name = "gpt-4o"
 
-        return ChatOpenAI(model=model_name, temperature=agent.temperature, api_key=api_key)
+        # Timeout e retries ficam por nossa conta (SLO do agente), não do client
+        return ChatOpenAI(
+            model=model_name,
+            temperature=agent.temperature,
+            api_key=api_key,
+            timeout=agent.latency_config.timeout_seconds,
+            max_retries=0
+        )
 
     def get_history(self, conversation_id: int):
-        """Recupera histórico do Redis"""
-        key = f"history:{conversation_id}"
-        data = redis_client.lrange(key, 0, -1)
+        """Recupera histórico (cópia local do worker se ainda válida, senão Redis)"""
+        from langchain_core.messages import HumanMessage, AIMessage
+
         history = []
-        for item in data:
-            msg = json.loads(item)
+        for msg in local_state.get_history(conversation_id):
             if msg["role"] == "user":
                 history.append(HumanMessage(content=msg["content"]))
             elif msg["role"] == "assistant":
                 history.append(AIMessage(content=msg["content"]))
         return history
 
-    def add_to_history(self, conversation_id: int, role: str, content: str):
-        """Salva mensagem no Redis (Max 20 mensagens para não estourar token)"""
-        key = f"history:{conversation_id}"
-        msg = json.dumps({"role": role, "content": content})
-        redis_client.rpush(key, msg)
-        # Mantém apenas as últimas 20 mensagens
-        if redis_client.llen(key) > 20:
-            redis_client.lpop(key)
-        redis_client.expire(key, 86400) # Expira em 24h
-
     def clear_history(self, conversation_id: int):
-        redis_client.delete(f"history:{conversation_id}")
+        ConversationTurn(conversation_id).clear_history().commit()
+
+    async def _invoke_once(self, agent: AgentConfig, model_name: str, messages: list, timeout: float):
+        """
+        Uma chamada ao modelo com timeout.
+        Usa agenerate (e não ainvoke) para ter o LLMResult: o uso de tokens só vem no llm_output.
+        """
+        llm = self.get_llm(agent, model_name)
+        return await asyncio.wait_for(llm.agenerate([messages]), timeout)
+
+    async def _invoke_hedged(self, agent: AgentConfig, model_name: str, messages: list, timeout: float):
+        """
+        Uma requisição lógica ao modelo, medida de ponta a ponta.
+        Hedge: se a 1ª chamada passar do p95 do modelo, dispara uma 2ª
+        e fica com a que responder primeiro com sucesso.
+        """
+        start = time.perf_counter()
+        try:
+            result = await self._race(agent, model_name, messages, timeout)
+        except asyncio.TimeoutError:
+            # Timeout também é amostra (senão o p95 fica baixo e o hedge dispara cada vez mais cedo)
+            latency_tracker.record(model_name, (time.perf_counter() - start) * 1000)
+            latency_tracker.record_error(model_name)
+            raise
+        except Exception:
+            latency_tracker.record_error(model_name)
+            raise
+        latency_tracker.record(model_name, (time.perf_counter() - start) * 1000)
+        return result
 
-    async def generate_response(self, agent: AgentConfig, user_input: str, conversation_id: int) -> str:
+    async def _race(self, agent: AgentConfig, model_name: str, messages: list, timeout: float):
+        cfg = agent.latency_config
+        if not cfg.hedge_enabled:
+            return await self._invoke_once(agent, model_name, messages, timeout)
+
+        delay_ms = cfg.hedge_delay_ms or latency_tracker.p95(model_name)
+        if delay_ms is None:
+            # Ainda sem amostras suficientes para saber o p95
+            return await self._invoke_once(agent, model_name, messages, timeout)
+        delay_ms = max(delay_ms, cfg.hedge_min_delay_ms)
+        deadline = time.monotonic() + timeout
+
+        first = asyncio.create_task(self._invoke_once(agent, model_name, messages, timeout))
+        done, _ = await asyncio.wait({first}, timeout=delay_ms / 1000)
+        remaining = deadline - time.monotonic()
+        if done or remaining <= 0:
+            return await first
+
+        logger.info(f"⏱️ {model_name} passou de {delay_ms:.0f}ms. Disparando requisição hedge.")
+        # A 2ª chamada respeita o mesmo prazo da requisição lógica
+        second = asyncio.create_task(self._invoke_once(agent, model_name, messages, remaining))
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _invoke_with_fallback(self, agent: AgentConfig, messages: list):
+        """
+        Retry com backoff exponencial + jitter no modelo principal, depois no fallback.
+        Tudo dentro do orçamento total do agente (total_budget_seconds).
+        Só falhas passageiras (ver is_retryable) são repetidas; as outras sobem na hora.
+        """
+        cfg = agent.latency_config
+        models = [agent.model_name]
+        if cfg.fallback_model_name and cfg.fallback_model_name != agent.model_name:
+            models.append(cfg.fallback_model_name)
+
+        deadline = time.monotonic() + cfg.total_budget_seconds
+        last_error = None
+        for model_name in models:
+            for attempt in range(cfg.max_retries + 1):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    timeout = min(cfg.timeout_seconds, remaining)
+                    return await self._invoke_hedged(agent, model_name, messages, timeout)
+                except Exception as e:
+                    if not is_retryable(e):
+                        logger.error(f"❌ {model_name} falhou sem chance de retry: {e!r}")
+                        raise
+                    last_error = e
+                    logger.warning(f"⚠️ {model_name} falhou (tentativa {attempt + 1}): {e!r}")
+                    if attempt < cfg.max_retries:
+                        backoff = min(cfg.backoff_max_seconds, cfg.backoff_base_seconds * (2 ** attempt))
+                        await asyncio.sleep(min(random.uniform(0, backoff), max(deadline - time.monotonic(), 0)))
+            if time.monotonic() >= deadline:
+                logger.warning(f"⌛ Orçamento de {cfg.total_budget_seconds}s esgotado. Desistindo.")
+                break
+            if model_name != models[-1]:
+                logger.warning(f"🔀 Usando modelo de fallback {models[-1]}")
+
+        raise last_error or asyncio.TimeoutError("Orçamento de latência esgotado")
+
+    async def generate_response(
+        self,
+        agent: AgentConfig,
+        user_input: str,
+        conversation_id: int,
+        turn: Optional[ConversationTurn] = None
+    ) -> str:
+        """
+        Gera a resposta do turno.
+        Se receber um `turn`, só registra as mensagens nele e quem chamou faz o commit;
+        senão grava o histórico na hora.
+        """
         try:
-            llm = self.get_llm(agent)
             history = self.get_history(conversation_id)
             
-            # Prompt com Histórico
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", "{system_prompt}"),
-                MessagesPlaceholder(variable_name="history"),
-                ("human", "{input}")
-            ])
-            
-            chain = prompt | llm | StrOutputParser()
+            # Prompt com Histórico (prefixo estático pré-renderizado por agente)
+            messages = prompt_builder.build_messages(agent, history, user_input)
             
             logger.info(f"🧠 Gerando resposta para conv {conversation_id}...")
-            response = await chain.ainvoke({
-                "system_prompt": agent.system_prompt,
-                "history": history,
-                "input": user_input
-            })
+            result = await self._invoke_with_fallback(agent, messages)
+            prompt_builder.record_usage(agent, result.llm_output)
+            response = result.generations[0][0].message.content
             
-            # Salva o turno atual na memória
-            self.add_to_history(conversation_id, "user", user_input)
-            self.add_to_history(conversation_id, "assistant", response)
+            # Salva o turno atual na memória (uma transação só)
+            pending = turn or ConversationTurn(conversation_id)
+            pending.add_message("user", user_input).add_message("assistant", response)
+            if turn is None:
+                pending.commit()
             
             return response
 
@@ -0,0 +1,104 @@
+# app/services/prompt_builder.py
+from app.models.agent import AgentConfig
+from app.core.redis import get_redis
+from typing import Any, Dict, Optional, Tuple
+import hashlib
+import logging
+
+logger = logging.getLogger("fvk.prompt")
+redis_client = get_redis()
+
+
+class PromptPrefix:
+    """Parte estática do prompt de um agente, renderizada uma única vez."""
+
+    def __init__(self, agent_id: str, system_prompt: str, model_name: str):
+        from langchain_core.messages import SystemMessage
+
+        self.agent_id = agent_id
+        self.system_prompt = system_prompt
+        self.model_name = model_name
+
+        # Normaliza espaços nas pontas para o prefixo ser sempre byte a byte igual
+        self.messages = [SystemMessage(content=system_prompt.strip())]
+        self.digest = hashlib.sha256(
+            f"{model_name}\x00{self.messages[0].content}".encode("utf-8")
+        ).hexdigest()
+
+    def matches(self, agent: AgentConfig) -> bool:
+        return self.system_prompt == agent.system_prompt and self.model_name == agent.model_name
+
+
+class PromptBuilder:
+    """
+    Monta as mensagens de cada turno mantendo o prefixo estável para o cache de prompt do provedor.
+    Ordem: [system do agente] + [histórico, do mais antigo ao mais novo] + [mensagem atual].
+    Nada dinâmico (datas, nomes, ids) entra no system, senão o prefixo muda a cada turno.
+    """
+
+    def __init__(self):
+        self._prefixes: Dict[str, PromptPrefix] = {}
+
+    def warm(self, agent: AgentConfig) -> PromptPrefix:
+        """Pré-renderiza o prefixo do agente (chamado quando a config é carregada)."""
+        return self.get_prefix(agent)
+
+    def get_prefix(self, agent: AgentConfig) -> PromptPrefix:
+        key = str(agent.id)
+        prefix = self._prefixes.get(key)
+        if prefix and prefix.matches(agent):
+            return prefix
+
+        prefix = PromptPrefix(key, agent.system_prompt, agent.model_name)
+        self._prefixes[key] = prefix
+        logger.info(f"🧩 Prefixo do agente {agent.name} renderizado (hash {prefix.digest[:12]})")
+        return prefix
+
+    def invalidate(self, agent_id):
+        self._prefixes.pop(str(agent_id), None)
+
+    def build_messages(self, agent: AgentConfig, history: list, user_input: str) -> list:
+        from langchain_core.messages import HumanMessage
+
+        prefix = self.get_prefix(agent)
+        return [*prefix.messages, *history, HumanMessage(content=user_input)]
+
+    def extract_usage(self, llm_output: Optional[dict]) -> Tuple[int, int]:
+        """
+        Retorna (prompt_tokens, cached_tokens) do llm_output da geração.
+        Com langchain-openai 0.0.7 o uso só vem em LLMResult.llm_output["token_usage"]
+        (o AIMessage não tem response_metadata); o cached_tokens fica no
+        prompt_tokens_details que a OpenAI devolve dentro do usage.
+        """
+        usage = (llm_output or {}).get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens") or 0
+        details = usage.get("prompt_tokens_details") or {}
+        if not isinstance(details, dict):
+            details = getattr(details, "__dict__", {}) or {}
+        cached_tokens = details.get("cached_tokens") or 0
+        return int(prompt_tokens), int(cached_tokens)
+
+    def record_usage(self, agent: AgentConfig, llm_output: Optional[dict]):
+        """Acumula tokens de prompt e tokens servidos do cache por agente."""
+        prompt_tokens, cached_tokens = self.extract_usage(llm_output)
+        if not prompt_tokens:
+            return
+        try:
+            key = f"metrics:prompt_cache:{agent.id}"
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.hincrby(key, "turns", 1)
+            pipe.hincrby(key, "prompt_tokens", prompt_tokens)
+            pipe.hincrby(key, "cached_tokens", cached_tokens)
+            pipe.hset(key, "prefix_hash", self.get_prefix(agent).digest)
+            pipe.execute()
+        except Exception as e:
+            logger.debug(f"Falha ao registrar uso de cache: {e}")
+
+        logger.info(f"📦 Cache de prompt ({agent.name}): {cached_tokens}/{prompt_tokens} tokens")
+
+    def get_metrics(self, agent_id) -> Dict[str, Any]:
+        data = redis_client.hgetall(f"metrics:prompt_cache:{agent_id}") or {}
+        return {k: (v if k == "prefix_hash" else int(v)) for k, v in data.items()}
+
+
+prompt_builder = PromptBuilder()
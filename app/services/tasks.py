@@ -1,16 +1,21 @@
 from app.core.celery_app import celery_app
-from app.core.redis import get_redis
+from app.core.locks import lock_manager
+from app.core.config import settings
+from app.core.database import get_supabase
+from app.core.sharding import ShardCoordinator, queue_for_conversation
 from app.services.agent_factory import agent_factory
 from app.services.llm_service import llm_service
 from app.services.chatwoot import chatwoot_service
+from app.services.conversation_store import ConversationTurn, drain_buffer, mark_bot_sent, restore_buffer
+from app.services.config_watcher import config_watcher
 from asgiref.sync import async_to_sync
+from celery.signals import worker_process_init, worker_ready, worker_shutdown
 import logging
 import json
 import time
 import re
 
 logger = logging.getLogger("fvk.worker")
-redis_client = get_redis()
 
 def split_message(text: str):
     """Divide em blocos legíveis, simulando envio humano."""
@@ -72,23 +77,60 @@ def split_message(text: str):
 
     return chunks or [text.strip()]
 
+def _is_prefork_pool(sender) -> bool:
+    pool_cls = getattr(getattr(sender, "controller", None), "pool_cls", None) or celery_app.conf.worker_pool
+    name = pool_cls if isinstance(pool_cls, str) else getattr(pool_cls, "__module__", "")
+    return "prefork" in name
+
+@worker_process_init.connect
+def start_config_watcher(**kwargs):
+    # Prefork: cada processo filho do worker mantém o cache de agentes em dia
+    config_watcher.start()
+
+@worker_ready.connect
+def start_config_watcher_in_main_process(sender=None, **kwargs):
+    # Pools sem processos filhos (threads, usado com sharding; solo; gevent) não
+    # disparam worker_process_init: o watcher sobe no processo principal
+    if not _is_prefork_pool(sender):
+        config_watcher.start()
+
+shard_coordinator = None
+
+@worker_ready.connect
+def start_shard_coordinator(sender=None, **kwargs):
+    # Processo principal do worker: entra no anel e assume as filas dos seus shards
+    global shard_coordinator
+    if not settings.SHARDING_ENABLED:
+        return
+    shard_coordinator = ShardCoordinator(celery_app, sender.hostname)
+    shard_coordinator.start()
+
+@worker_shutdown.connect
+def stop_shard_coordinator(**kwargs):
+    if shard_coordinator:
+        shard_coordinator.stop()
+
+def part_delay(part: str) -> float:
+    """Delay humano entre mensagens (proporcional ao tamanho, min 1s, max 4s)."""
+    return min(max(len(part) * 0.05, 1), 4)
+
 @celery_app.task(bind=True, name="process_message_buffer")
 def process_message_buffer(self, conversation_id: int, account_id: int, inbox_name: str):
-    lock_key = f"lock:processing:{conversation_id}"
-    buffer_key = f"buffer:{conversation_id}"
-    
-    # Lock para evitar processamento duplicado
-    if not redis_client.set(lock_key, "locked", ex=60, nx=True):
+    # Lock para evitar processamento duplicado.
+    # Se já estiver ocupado, o lock_manager marca a conversa para rodar de novo
+    # quando o dono atual terminar, então as mensagens do buffer não ficam órfãs.
+    lock = lock_manager.acquire(conversation_id)
+    if not lock:
         return
 
+    messages = []
+    committed = False
     try:
-        # Lê Buffer
-        messages = redis_client.lrange(buffer_key, 0, -1)
+        # Lê e limpa o Buffer numa transação só
+        messages = drain_buffer(conversation_id)
         if not messages:
             return
         
-        redis_client.delete(buffer_key)
-        
         # Junta mensagens do usuário
         full_text = " ".join([json.loads(m)["content"] for m in messages])
         logger.info(f"🔥 PROCESSANDO {conversation_id}: {full_text}")
@@ -98,16 +140,37 @@ def process_message_buffer(self, conversation_id: int, account_id: int, inbox_na
             return
 
         # Gera resposta (AGORA COM MEMÓRIA PASSANDO O ID)
-        response_text = async_to_sync(llm_service.generate_response)(agent, full_text, conversation_id)
+        # O histórico fica pendente no turno e só é gravado se o lock ainda for nosso.
+        turn = ConversationTurn(conversation_id)
+        response_text = async_to_sync(llm_service.generate_response)(agent, full_text, conversation_id, turn)
         
         # Quebra a resposta (Humanização)
         message_parts = split_message(response_text)
+        delays = [part_delay(part) for part in message_parts]
+
+        # Grava o histórico numa transação, só se o lock ainda for nosso (fencing)
+        if not turn.commit(lock=lock):
+            # Perdemos o lock: devolve as mensagens ao buffer e agenda de novo,
+            # senão elas somem sem resposta e sem histórico.
+            restore_buffer(conversation_id, messages)
+            process_message_buffer.apply_async(
+                args=[conversation_id, account_id, inbox_name],
+                countdown=1,
+                queue=queue_for_conversation(conversation_id)
+            )
+            return
+        committed = True
 
-        for part in message_parts:
-            # 1. Marca que o bot está enviando (para o webhook não pausar)
-            # Define validade de 10s, suficiente para o webhook receber o evento 'message_created'
-            redis_client.setex(f"bot_sent:{conversation_id}", 10, "1")
+        for part, delay in zip(message_parts, delays):
+            # Se perdemos o lease, outro worker pode estar respondendo: para de enviar.
+            if lock.lost:
+                logger.warning(f"⚠️ Lock perdido na conversa {conversation_id}. Interrompendo envio.")
+                break
             
+            # 1. Marca que o bot está enviando (para o webhook não pausar)
+            # Validade de 10s a partir deste envio, suficiente para receber o 'message_created'
+            mark_bot_sent(conversation_id)
+
             # 2. Envia a parte
             async_to_sync(chatwoot_service.send_text_message)(
                 account_id=account_id, 
@@ -115,11 +178,48 @@ def process_message_buffer(self, conversation_id: int, account_id: int, inbox_na
                 message=part
             )
             
-            # 3. Delay humano entre mensagens (proporcional ao tamanho, min 1s, max 4s)
-            delay = min(max(len(part) * 0.05, 1), 4)
+            # 3. Delay humano entre mensagens
             time.sleep(delay)
 
     except Exception as e:
         logger.error(f"Erro worker: {e}")
+        if messages and not committed:
+            # Falhou antes de gravar o turno: devolve as mensagens drenadas ao buffer
+            # (o próximo processamento da conversa responde a elas).
+            try:
+                restore_buffer(conversation_id, messages)
+            except Exception as restore_error:
+                logger.error(f"Erro ao devolver buffer da conversa {conversation_id}: {restore_error}")
     finally:
-        redis_client.delete(lock_key)
+        rerun = False
+        try:
+            rerun = lock.release()
+        except Exception as e:
+            logger.error(f"Erro ao liberar lock da conversa {conversation_id}: {e}")
+
+        # Chegaram mensagens enquanto processávamos: roda de novo para não deixá-las no buffer.
+        if rerun:
+            logger.info(f"🔁 Reprocessando buffer da conversa {conversation_id}")
+            process_message_buffer.apply_async(
+                args=[conversation_id, account_id, inbox_name],
+                countdown=1,
+                queue=queue_for_conversation(conversation_id)
+            )
+
+@celery_app.task(bind=True, name="mirror_conversation_history", max_retries=3)
+def mirror_conversation_history(self, conversation_id: int, messages: list):
+    """Grava o histórico no Supabase (fora do caminho da resposta)."""
+    rows = [
+        {
+            "conversation_id": conversation_id,
+            "role": m["role"],
+            "content": m["content"],
+            "created_at": m["created_at"]
+        }
+        for m in messages
+    ]
+    try:
+        get_supabase().table(settings.HISTORY_MIRROR_TABLE).insert(rows).execute()
+    except Exception as e:
+        logger.error(f"Erro ao espelhar histórico da conversa {conversation_id}: {e}")
+        raise self.retry(exc=e)
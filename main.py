@@ -1,5 +1,9 @@
 from fastapi import FastAPI
-from app.services.agent_factory import agent_factory
+from app.core.container import container
+from app.core.locks import lock_manager
+from app.services.latency import latency_tracker
+from app.services.config_watcher import config_watcher
+from app.services.prompt_builder import prompt_builder
 # 👇 Importe o router novo
 from app.api.webhook import router as webhook_router
 
@@ -8,10 +12,39 @@ app = FastAPI(title="FVK Backend - Python Core")
 # 👇 Registre a rota com um prefixo
 app.include_router(webhook_router, prefix="/api/v1/webhook", tags=["Webhook"])
 
+@app.on_event("startup")
+def start_config_watcher():
+    # Mantém o cache de agentes em dia com as mudanças feitas no admin
+    config_watcher.start()
+
+@app.on_event("shutdown")
+def stop_config_watcher():
+    config_watcher.stop()
+
 @app.get("/")
 def health_check():
     return {"status": "online", "message": "Backend Python operante 🚀"}
 
+@app.get("/metrics/locks")
+def lock_metrics():
+    """Contadores de contenção dos locks de processamento por conversa."""
+    return lock_manager.metrics()
+
+@app.get("/metrics/llm")
+def llm_metrics():
+    """Latência por modelo (p50/p95/p99), somando as amostras de todos os workers (Redis)."""
+    return latency_tracker.snapshot()
+
+@app.get("/metrics/prompt_cache/{agent_id}")
+def prompt_cache_metrics(agent_id: str):
+    """Tokens de prompt x tokens servidos do cache do provedor, por agente."""
+    return prompt_builder.get_metrics(agent_id)
+
+@app.get("/metrics/startup")
+def startup_metrics():
+    """Serviços carregados sob demanda neste processo e o tempo de carga de cada um (ms)."""
+    return container.loaded()
+
 # ... (mantenha a rota de teste antiga se quiser) ...
 
 if __name__ == "__main__":
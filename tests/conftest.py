@@ -0,0 +1,10 @@
+import os
+import sys
+from pathlib import Path
+
+# Settings() exige essas variáveis no import; nos testes nenhum serviço externo é usado
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "test-key")
+os.environ.setdefault("CHATWOOT_ACCESS_TOKEN", "test-token")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
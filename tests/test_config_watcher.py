@@ -0,0 +1,229 @@
+import json
+import time
+import uuid
+
+from app.core.config import settings
+from app.services import agent_factory as agent_factory_module
+from app.services.agent_factory import AgentFactory
+from app.services.config_watcher import ConfigWatcher, RedisChangeFeed, UpdatedAtPoller, publish_agent_change
+
+
+# --- Fakes -------------------------------------------------------------------
+
+class FakePubSub:
+    def __init__(self, broker):
+        self.broker = broker
+        self.channels = set()
+        self.closed = False
+
+    def subscribe(self, channel):
+        self.channels.add(channel)
+        self.broker.subscribers.append(self)
+
+    def get_message(self, timeout=0):
+        if self.broker.queue:
+            return self.broker.queue.pop(0)
+        time.sleep(0.01)
+        return None
+
+    def close(self):
+        self.closed = True
+
+
+class FakeRedis:
+    """Publisher/pubsub em memória no formato do redis-py."""
+
+    def __init__(self):
+        self.queue = []
+        self.subscribers = []
+
+    def pubsub(self, ignore_subscribe_messages=True):
+        return FakePubSub(self)
+
+    def publish(self, channel, data):
+        self.queue.append({"type": "message", "channel": channel, "data": data})
+        return len(self.subscribers)
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    def __init__(self, db, table):
+        self.db = db
+        self.table_name = table
+        self.filters = []
+
+    def select(self, *args):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(("eq", column, value))
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(("gte", column, value))
+        return self
+
+    def order(self, column, desc=False):
+        self.filters.append(("order", column, desc))
+        return self
+
+    def limit(self, n):
+        self.filters.append(("limit", None, n))
+        return self
+
+    def execute(self):
+        if self.db.on_execute:
+            self.db.on_execute(self)
+        rows = self.db.tables.get(self.table_name, [])
+        for op, column, value in self.filters:
+            if op == "gte":
+                rows = [r for r in rows if r.get(column) and r[column] >= value]
+            elif op == "order":
+                rows = sorted(rows, key=lambda r: r.get(column) or "", reverse=value)
+            elif op == "limit":
+                rows = rows[:value]
+        return FakeResponse(rows)
+
+
+class FakeDB:
+    """Client no formato do Supabase (table().select().eq()...execute())."""
+
+    def __init__(self, tables=None):
+        self.tables = tables or {}
+        self.on_execute = None
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+
+class RecordingFactory:
+    def __init__(self):
+        self.changes = []
+
+    def apply_change(self, agent_id, fields=None):
+        self.changes.append((agent_id, fields))
+
+    def evict(self, agent_id):
+        pass
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+# --- Feeds -------------------------------------------------------------------
+
+def test_redis_feed_delivers_published_delta_through_watcher():
+    fake = FakeRedis()
+    factory = RecordingFactory()
+    watcher = ConfigWatcher(factory=factory)
+    watcher.start(source=RedisChangeFeed(watcher.apply, redis_conn=fake))
+    try:
+        publish_agent_change("agent-1", {"debounce_seconds": 3}, redis_conn=fake)
+        assert wait_for(lambda: factory.changes)
+        assert factory.changes == [("agent-1", {"debounce_seconds": 3})]
+    finally:
+        watcher.stop()
+
+
+def test_redis_feed_ignores_invalid_payload():
+    factory = RecordingFactory()
+    feed = RedisChangeFeed(factory.apply_change, redis_conn=FakeRedis())
+    feed.handle_message({"type": "message", "data": "not-json"})
+    feed.handle_message({"type": "subscribe", "data": 1})
+    assert factory.changes == []
+
+
+def test_poller_reports_each_changed_agent_once():
+    db = FakeDB({
+        "agents": [{"id": "a0", "updated_at": "2024-01-01T00:00:00+00:00"}],
+        "agent_tools": [],
+        "agent_rag": [{"agent_id": "a2", "updated_at": "2000-01-01T00:00:00+00:00"}],
+    })
+    factory = RecordingFactory()
+    poller = UpdatedAtPoller(factory.apply_change, db=db, interval_seconds=1)
+
+    # 1ª rodada só marca o maior updated_at do banco (não o relógio da aplicação)
+    assert poller.poll_once() == 0
+    assert poller.since == "2024-01-01T00:00:00+00:00"
+
+    db.tables["agents"].append({"id": "a1", "updated_at": "2024-01-01T00:00:01+00:00"})
+    db.tables["agent_tools"].append({"agent_id": "a1", "updated_at": "2024-01-01T00:00:02+00:00"})
+    assert poller.poll_once() == 1
+    assert factory.changes == [("a1", None)]
+    assert poller.since == "2024-01-01T00:00:02+00:00"
+
+    # Nada novo desde a última rodada (a linha do marco não é repetida)
+    assert poller.poll_once() == 0
+
+
+def test_poller_sees_row_written_at_same_timestamp_as_since():
+    db = FakeDB({
+        "agents": [{"id": "a1", "updated_at": "2024-01-01T00:00:05+00:00"}],
+        "agent_tools": [],
+        "agent_rag": [],
+    })
+    factory = RecordingFactory()
+    poller = UpdatedAtPoller(factory.apply_change, db=db, interval_seconds=1)
+    poller.poll_once()
+
+    # Outra escrita no mesmo instante do marco (commit atrasado): com > ela se perderia
+    db.tables["agent_rag"].append({"agent_id": "a3", "updated_at": "2024-01-01T00:00:05+00:00"})
+    assert poller.poll_once() == 1
+    assert factory.changes == [("a3", None)]
+    assert poller.poll_once() == 0
+
+
+# --- Cache do AgentFactory -----------------------------------------------------
+
+def agent_row(agent_id, prompt):
+    return {
+        "id": agent_id,
+        "name": "Agente",
+        "system_prompt": prompt,
+        "chatwoot_config": {"account_id": "1", "inbox_name": "inbox"},
+        "is_active": True,
+    }
+
+
+def test_change_during_load_is_not_cached(monkeypatch):
+    agent_id = str(uuid.uuid4())
+    db = FakeDB({"agents": [agent_row(agent_id, "v1")], "agent_tools": [], "agent_rag": []})
+    monkeypatch.setattr(agent_factory_module, "get_supabase", lambda: db)
+    monkeypatch.setattr(settings, "AGENT_CONFIG_WATCH_MODE", "pubsub")
+    factory = AgentFactory()
+
+    # Mudança chega enquanto a busca no banco ainda está em andamento
+    def change_mid_load(query):
+        if query.table_name == "agents":
+            db.on_execute = None
+            factory.apply_change(agent_id)
+    db.on_execute = change_mid_load
+
+    assert factory.get_agent_by_chatwoot(1, "inbox").system_prompt == "v1"
+
+    db.tables["agents"] = [agent_row(agent_id, "v2")]
+    assert factory.get_agent_by_chatwoot(1, "inbox").system_prompt == "v2"
+
+
+def test_scalar_delta_updates_cached_agent(monkeypatch):
+    agent_id = str(uuid.uuid4())
+    db = FakeDB({"agents": [agent_row(agent_id, "v1")], "agent_tools": [], "agent_rag": []})
+    monkeypatch.setattr(agent_factory_module, "get_supabase", lambda: db)
+    monkeypatch.setattr(settings, "AGENT_CONFIG_WATCH_MODE", "pubsub")
+    factory = AgentFactory()
+
+    factory.get_agent_by_chatwoot(1, "inbox")
+    factory.apply_change(agent_id, json.loads('{"system_prompt": "v2"}'))
+
+    # Sem ir ao banco: a tabela ainda tem v1
+    assert factory.get_agent_by_chatwoot(1, "inbox").system_prompt == "v2"
@@ -0,0 +1,68 @@
+import json
+
+from app.core.config import settings
+from app.services import conversation_store
+from app.services.conversation_store import LocalConversationState, history_version_key
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def lrange(self, key, start, end):
+        return list(self.data.get(key, []))
+
+
+def write_history(fake, conversation_id, version, messages):
+    fake.data[f"history:{conversation_id}"] = [json.dumps(m) for m in messages]
+    fake.data[history_version_key(conversation_id)] = version
+
+
+def setup(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(conversation_store, "redis_client", fake)
+    monkeypatch.setattr(settings, "SHARDING_ENABLED", True)
+    return fake, LocalConversationState(max_conversations=10)
+
+
+def test_expired_history_is_not_served_from_local_copy(monkeypatch):
+    fake, state = setup(monkeypatch)
+    old = [{"role": "user", "content": "ontem"}]
+    write_history(fake, 1, "v-a", old)
+    assert state.get_history(1) == old
+
+    # Histórico e versão expiram; outro processo grava um turno novo
+    fake.data.clear()
+    new = [{"role": "user", "content": "hoje"}]
+    write_history(fake, 1, "v-b", new)
+    assert state.get_history(1) == new
+
+
+def test_history_without_version_is_not_cached(monkeypatch):
+    fake, state = setup(monkeypatch)
+    fake.data["history:1"] = [json.dumps({"role": "user", "content": "legado"})]
+    assert state.get_history(1) == [{"role": "user", "content": "legado"}]
+
+    fake.data.clear()
+    assert state.get_history(1) == []
+
+
+def test_own_commit_updates_local_copy_only_from_previous_version(monkeypatch):
+    fake, state = setup(monkeypatch)
+    write_history(fake, 1, "v-a", [{"role": "user", "content": "oi"}])
+    state.get_history(1)
+
+    reply = [{"role": "assistant", "content": "olá", "created_at": "x"}]
+    state.on_commit(1, "v-a", "v-b", False, reply)
+    fake.data[history_version_key(1)] = "v-b"
+    # Sem LRANGE: a cópia local já tem o turno
+    fake.data["history:1"] = []
+    assert state.get_history(1) == [{"role": "user", "content": "oi"}, {"role": "assistant", "content": "olá"}]
+
+    # Versão anterior diferente (alguém escreveu no meio): descarta
+    state.on_commit(1, "v-x", "v-c", False, reply)
+    fake.data[history_version_key(1)] = "v-c"
+    assert state.get_history(1) == []
@@ -0,0 +1,136 @@
+import asyncio
+import time
+import uuid
+
+import fakeredis
+import pytest
+
+from app.models.agent import AgentConfig, AgentLatencySchema
+from app.services import llm_service as llm_service_module
+from app.services.latency import ModelLatencyTracker
+from app.services.llm_service import LLMService, is_retryable
+
+
+class StatusError(Exception):
+    """Erro com status HTTP, no formato dos erros do client da OpenAI."""
+
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class ScriptedInvoke:
+    """Substitui LLMService._invoke_once: cada chamada consome um passo do roteiro."""
+
+    def __init__(self, steps):
+        self.steps = list(steps)
+        self.calls = []
+        self.cancelled = []
+
+    async def __call__(self, agent, model_name, messages, timeout):
+        index = len(self.calls)
+        self.calls.append((model_name, timeout))
+        delay, outcome = self.steps[index]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self.cancelled.append(index)
+            raise
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+def make_agent(**latency):
+    latency.setdefault("backoff_base_seconds", 0.01)
+    latency.setdefault("backoff_max_seconds", 0.01)
+    return AgentConfig(
+        id=uuid.uuid4(),
+        name="Atendente",
+        system_prompt="Você é um atendente.",
+        model_name="gpt-4o",
+        latency_config=AgentLatencySchema(**latency),
+    )
+
+
+@pytest.fixture
+def service(monkeypatch):
+    tracker = ModelLatencyTracker(redis_conn=fakeredis.FakeRedis(decode_responses=True))
+    monkeypatch.setattr(llm_service_module, "latency_tracker", tracker)
+    return LLMService()
+
+
+def run(service, agent, steps):
+    invoke = ScriptedInvoke(steps)
+    service._invoke_once = invoke
+    return invoke, asyncio.run(service._invoke_with_fallback(agent, []))
+
+
+def test_retryable_errors():
+    assert is_retryable(asyncio.TimeoutError())
+    assert is_retryable(ConnectionError())
+    assert is_retryable(StatusError(429))
+    assert is_retryable(StatusError(503))
+    assert not is_retryable(StatusError(400))
+    assert not is_retryable(StatusError(401))
+    assert not is_retryable(ValueError("API Key não configurada"))
+
+
+def test_retries_transient_error_then_succeeds(service):
+    agent = make_agent(max_retries=2)
+    invoke, result = run(service, agent, [(0, asyncio.TimeoutError()), (0, StatusError(429)), (0, "ok")])
+    assert result == "ok"
+    assert [m for m, _ in invoke.calls] == ["gpt-4o"] * 3
+
+
+def test_non_retryable_error_fails_fast(service):
+    agent = make_agent(max_retries=2, fallback_model_name="gpt-4o-mini")
+    invoke = ScriptedInvoke([(0, ValueError("API Key não configurada"))])
+    service._invoke_once = invoke
+    with pytest.raises(ValueError):
+        asyncio.run(service._invoke_with_fallback(agent, []))
+    assert len(invoke.calls) == 1
+
+
+def test_falls_back_after_retries(service):
+    agent = make_agent(max_retries=1, fallback_model_name="gpt-4o-mini")
+    invoke, result = run(service, agent, [(0, StatusError(503)), (0, StatusError(502)), (0, "fallback")])
+    assert result == "fallback"
+    assert [m for m, _ in invoke.calls] == ["gpt-4o", "gpt-4o", "gpt-4o-mini"]
+
+
+def test_timeout_clamped_to_total_budget(service):
+    agent = make_agent(timeout_seconds=30, total_budget_seconds=0.5)
+    invoke, _ = run(service, agent, [(0, "ok")])
+    assert invoke.calls[0][1] <= 0.5
+
+
+def test_hedge_second_request_wins_and_loser_is_cancelled(service):
+    agent = make_agent(hedge_enabled=True, hedge_delay_ms=50, hedge_min_delay_ms=10, timeout_seconds=2)
+    invoke, result = run(service, agent, [(1.0, "lenta"), (0, "hedge")])
+    assert result == "hedge"
+    assert len(invoke.calls) == 2
+    assert invoke.cancelled == [0]
+
+
+def test_hedge_first_request_still_wins(service):
+    agent = make_agent(hedge_enabled=True, hedge_delay_ms=50, hedge_min_delay_ms=10, timeout_seconds=2)
+    invoke, result = run(service, agent, [(0.1, "primeira"), (1.0, "hedge")])
+    assert result == "primeira"
+    assert invoke.cancelled == [1]
+
+
+def test_hedge_waits_for_other_request_when_one_fails(service):
+    agent = make_agent(hedge_enabled=True, hedge_delay_ms=50, hedge_min_delay_ms=10,
+                       timeout_seconds=2, max_retries=0)
+    invoke, result = run(service, agent, [(0.2, "primeira"), (0, StatusError(503))])
+    assert result == "primeira"
+
+
+def test_hedge_request_gets_remaining_deadline(service):
+    agent = make_agent(hedge_enabled=True, hedge_delay_ms=300, hedge_min_delay_ms=10, timeout_seconds=1)
+    start = time.monotonic()
+    invoke, _ = run(service, agent, [(0.5, "primeira"), (1.0, "hedge")])
+    assert invoke.calls[0][1] == 1
+    assert invoke.calls[1][1] <= 0.75
+    assert time.monotonic() - start < 1
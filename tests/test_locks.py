@@ -0,0 +1,100 @@
+import time
+
+import fakeredis
+import pytest
+import redis
+
+from app.core.locks import LockManager
+
+
+@pytest.fixture
+def fake():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def make_manager(fake, ttl_seconds=60):
+    return LockManager(redis_client=fake, ttl_seconds=ttl_seconds, rerun_ttl_seconds=3600)
+
+
+def test_contention_sets_rerun_flag(fake):
+    manager = make_manager(fake)
+    lock = manager.acquire(1)
+    assert lock is not None
+
+    assert manager.acquire(1) is None
+    assert fake.get(manager.rerun_key(1)) == "1"
+    assert 0 < fake.ttl(manager.rerun_key(1)) <= 3600
+    assert manager.metrics()["contended"] == 1
+    lock.release()
+
+
+def test_release_returns_and_consumes_rerun(fake):
+    manager = make_manager(fake)
+    lock = manager.acquire(1)
+    manager.acquire(1)
+
+    assert lock.release() is True
+    assert fake.get(manager.lock_key(1)) is None
+    assert fake.get(manager.rerun_key(1)) is None
+
+    # Sem contenção não há rerun
+    lock = manager.acquire(1)
+    assert lock.release() is False
+
+
+def test_release_does_not_delete_foreign_token(fake):
+    manager = make_manager(fake)
+    lock = manager.acquire(1)
+    # Lease expirou e outro worker pegou o lock
+    fake.set(manager.lock_key(1), "other-worker")
+
+    lock.release()
+    assert fake.get(manager.lock_key(1)) == "other-worker"
+    assert manager.metrics()["lost_on_release"] == 1
+
+
+def test_renewal_keeps_key_alive(fake):
+    manager = make_manager(fake, ttl_seconds=1)
+    lock = manager.acquire(1)
+
+    time.sleep(1.5)
+    assert fake.get(manager.lock_key(1)) == lock.token
+    assert not lock.lost
+    assert lock.is_held()
+    lock.release()
+
+
+def test_renewal_error_does_not_mark_lost(fake, monkeypatch):
+    manager = make_manager(fake, ttl_seconds=3)
+    lock = manager.acquire(1)
+    lock._stop.set()
+    lock._thread.join()
+
+    original_eval = fake.eval
+    failures = {"left": 1}
+
+    def flaky_eval(*args):
+        if failures["left"]:
+            failures["left"] -= 1
+            raise redis.ConnectionError("blip")
+        return original_eval(*args)
+
+    monkeypatch.setattr(fake, "eval", flaky_eval)
+
+    # Primeira renovação falha (erro de rede), a seguinte funciona: o lock continua nosso
+    lock._stop.clear()
+    lock.start_renewal()
+    time.sleep(2.5)
+    assert failures["left"] == 0
+    assert not lock.lost
+    assert lock.is_held()
+    lock.release()
+
+
+def test_renew_returns_false_when_token_changed(fake):
+    manager = make_manager(fake)
+    lock = manager.acquire(1)
+    fake.set(manager.lock_key(1), "other-worker")
+
+    assert lock.renew() is False
+    lock.release()
@@ -0,0 +1,88 @@
+import asyncio
+import uuid
+
+import fakeredis
+import pytest
+
+pytest.importorskip("langchain_openai")
+
+from app.models.agent import AgentConfig
+from app.services import prompt_builder as prompt_builder_module
+from app.services.llm_service import LLMService
+from app.services.prompt_builder import PromptBuilder
+
+# Resposta do /chat/completions como a OpenAI devolve com cache de prompt
+OPENAI_RESPONSE = {
+    "id": "chatcmpl-abc123",
+    "object": "chat.completion",
+    "created": 1727000000,
+    "model": "gpt-4o-2024-08-06",
+    "system_fingerprint": "fp_abc",
+    "choices": [{
+        "index": 0,
+        "message": {"role": "assistant", "content": "Olá! Como posso ajudar?"},
+        "logprobs": None,
+        "finish_reason": "stop",
+    }],
+    "usage": {
+        "prompt_tokens": 2006,
+        "completion_tokens": 300,
+        "total_tokens": 2306,
+        "prompt_tokens_details": {"cached_tokens": 1920, "audio_tokens": 0},
+        "completion_tokens_details": {"reasoning_tokens": 0},
+    },
+}
+
+
+class FakeCompletions:
+    """No lugar de AsyncOpenAI().chat.completions."""
+
+    async def create(self, **kwargs):
+        from openai.types.chat import ChatCompletion
+        return ChatCompletion.model_validate(OPENAI_RESPONSE)
+
+
+def make_agent():
+    return AgentConfig(
+        id=uuid.uuid4(),
+        name="Atendente",
+        system_prompt="Você é um atendente.",
+        model_name="gpt-4o",
+        openai_api_key="sk-test",
+    )
+
+
+def test_cached_tokens_recorded_from_provider_response(monkeypatch):
+    fake = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(prompt_builder_module, "redis_client", fake)
+
+    service = LLMService()
+    build_llm = service.get_llm
+
+    def get_llm(agent, model_name=None):
+        llm = build_llm(agent, model_name)
+        llm.async_client = FakeCompletions()
+        return llm
+
+    monkeypatch.setattr(service, "get_llm", get_llm)
+
+    agent = make_agent()
+    builder = PromptBuilder()
+    messages = builder.build_messages(agent, [], "oi")
+    result = asyncio.run(service._invoke_once(agent, agent.model_name, messages, timeout=5))
+
+    assert result.generations[0][0].message.content == "Olá! Como posso ajudar?"
+    assert builder.extract_usage(result.llm_output) == (2006, 1920)
+
+    builder.record_usage(agent, result.llm_output)
+    metrics = builder.get_metrics(agent.id)
+    assert metrics["turns"] == 1
+    assert metrics["prompt_tokens"] == 2006
+    assert metrics["cached_tokens"] == 1920
+    assert metrics["prefix_hash"] == builder.get_prefix(agent).digest
+
+
+def test_usage_without_cache_details():
+    builder = PromptBuilder()
+    assert builder.extract_usage({"token_usage": {"prompt_tokens": 50, "total_tokens": 60}}) == (50, 0)
+    assert builder.extract_usage(None) == (0, 0)